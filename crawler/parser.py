@@ -1,31 +1,81 @@
 import re
+from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional, Dict, Any
-from bs4 import BeautifulSoup
-import pytz
+from zoneinfo import ZoneInfo
+import lxml.html
+from lxml import etree
 
 from config import settings
 
 
-def parse_article_list(html: str) -> list[Dict[str, Any]]:
+@dataclass(slots=True)
+class ArticleRecord:
+    """爬取到的 PTT 文章"""
+    article_id: str  # PTT 文章 ID
+    title: str  # 文章標題
+    url: str  # 文章連結
+    author: str  # 發文者
+    date: str  # 列表頁日期 (格式: 12/05)
+    content: str = ''  # 完整內容
+    post_time: Optional[datetime] = None  # 發文時間
+    board: str = ''  # 看板
+
+
+def _class_xpath(class_name: str) -> str:
+    """產生與 CSS `.class_name` 相同語意的 XPath 條件"""
+    return f'contains(concat(" ", normalize-space(@class), " "), " {class_name} ")'
+
+
+_ARTICLE_ID_RE = re.compile(r'/([A-Z]\.\d+\.[A-Z]\.[A-Z0-9]+)\.html')
+_WHITESPACE_RE = re.compile(r'\s+')
+_PTT_DATETIME_FORMAT = '%a %b %d %H:%M:%S %Y'
+_TZ = ZoneInfo(settings.TIMEZONE)
+
+# 預先編譯的文章列表 XPath
+_ENTRY_XP = etree.XPath(f'//div[{_class_xpath("r-ent")}]')
+_TITLE_LINK_XP = etree.XPath(f'./div[{_class_xpath("title")}]//a')
+_AUTHOR_XP = etree.XPath(f'./div[{_class_xpath("meta")}]//div[{_class_xpath("author")}]')
+_DATE_XP = etree.XPath(f'./div[{_class_xpath("meta")}]//div[{_class_xpath("date")}]')
+
+# 預先編譯的文章內容 XPath
+_METALINE_XP = etree.XPath(f'//div[{_class_xpath("article-metaline")}]')
+_META_TAG_XP = etree.XPath(f'.//span[{_class_xpath("article-meta-tag")}]')
+_META_VALUE_XP = etree.XPath(f'.//span[{_class_xpath("article-meta-value")}]')
+_MAIN_CONTENT_XP = etree.XPath('//div[@id="main-content"]')
+_PREV_PAGE_RE = re.compile(r'<a\b[^>]*\bhref="([^"]+)"[^>]*>[^<]*上頁')
+_PREV_PAGE_XP = etree.XPath(f'//div[{_class_xpath("btn-group-paging")}]//a[contains(., "上頁")]/@href')
+_NON_CONTENT_XP = etree.XPath(
+    f'.//div[{_class_xpath("article-metaline")} or {_class_xpath("article-metaline-right")}'
+    f' or {_class_xpath("push")}]'
+)
+
+
+def parse_article_list(html: str) -> list[ArticleRecord]:
     """
     解析 PTT 看板的文章列表頁面
     
     Returns:
-        list: 文章資訊列表，每個元素包含 title, url, author, date, article_id
+        list: 文章列表 (尚未包含內容)
     """
-    soup = BeautifulSoup(html, 'lxml')
+    try:
+        root = lxml.html.fromstring(html)
+    except (etree.ParserError, ValueError):
+        return []
+    
     articles = []
     
     # 找到所有文章區塊
-    for entry in soup.select('div.r-ent'):
+    for entry in _ENTRY_XP(root):
         try:
             # 標題和連結
-            title_elem = entry.select_one('div.title a')
-            if not title_elem:
+            title_elems = _TITLE_LINK_XP(entry)
+            if not title_elems:
                 continue  # 可能是已刪除的文章
+            title_elem = title_elems[0]
             
-            title = title_elem.get_text(strip=True)
+            title = title_elem.text_content().strip()
             url = title_elem.get('href', '')
             
             # 完整 URL
@@ -36,20 +86,20 @@ def parse_article_list(html: str) -> list[Dict[str, Any]]:
             article_id = extract_article_id(url)
             
             # 作者
-            author_elem = entry.select_one('div.meta div.author')
-            author = author_elem.get_text(strip=True) if author_elem else ''
+            author_elems = _AUTHOR_XP(entry)
+            author = author_elems[0].text_content().strip() if author_elems else ''
             
             # 日期 (格式: 12/05)
-            date_elem = entry.select_one('div.meta div.date')
-            date_str = date_elem.get_text(strip=True) if date_elem else ''
+            date_elems = _DATE_XP(entry)
+            date_str = date_elems[0].text_content().strip() if date_elems else ''
             
-            articles.append({
-                'title': title,
-                'url': url,
-                'author': author,
-                'date': date_str,
-                'article_id': article_id
-            })
+            articles.append(ArticleRecord(
+                article_id=article_id,
+                title=title,
+                url=url,
+                author=author,
+                date=date_str
+            ))
             
         except Exception as e:
             print(f"解析文章列表項目失敗: {e}")
@@ -65,7 +115,6 @@ def parse_article_content(html: str) -> Dict[str, Any]:
     Returns:
         dict: 包含 content, post_time 等詳細資訊
     """
-    soup = BeautifulSoup(html, 'lxml')
     result = {
         'content': '',
         'post_time': None,
@@ -74,15 +123,19 @@ def parse_article_content(html: str) -> Dict[str, Any]:
         'board': ''
     }
     
+    try:
+        root = lxml.html.fromstring(html)
+    except (etree.ParserError, ValueError):
+        return result
+    
     try:
         # 解析 meta 資訊 (作者、看板、標題、時間)
-        metalines = soup.select('div.article-metaline')
-        for metaline in metalines:
-            tag = metaline.select_one('span.article-meta-tag')
-            value = metaline.select_one('span.article-meta-value')
-            if tag and value:
-                tag_text = tag.get_text(strip=True)
-                value_text = value.get_text(strip=True)
+        for metaline in _METALINE_XP(root):
+            tags = _META_TAG_XP(metaline)
+            values = _META_VALUE_XP(metaline)
+            if tags and values:
+                tag_text = tags[0].text_content().strip()
+                value_text = values[0].text_content().strip()
                 
                 if tag_text == '作者':
                     result['author'] = value_text.split('(')[0].strip()
@@ -94,18 +147,15 @@ def parse_article_content(html: str) -> Dict[str, Any]:
                     result['post_time'] = parse_ptt_datetime(value_text)
         
         # 解析文章內容
-        main_content = soup.select_one('div#main-content')
-        if main_content:
-            # 移除 meta 資訊和推文
-            for elem in main_content.select('div.article-metaline, div.article-metaline-right, div.push'):
-                elem.decompose()
+        main_contents = _MAIN_CONTENT_XP(root)
+        if main_contents:
+            main_content = main_contents[0]
+            # 移除 meta 資訊和推文 (drop_tree 會保留節點後方的文字)
+            for elem in _NON_CONTENT_XP(main_content):
+                elem.drop_tree()
             
-            # 取得純文字內容
-            content = main_content.get_text()
-            
-            # 移除簽名檔 (--\n 之後的內容)
-            if '\n--\n' in content:
-                content = content.split('\n--\n')[0]
+            # 取得純文字內容，並移除簽名檔 (--\n 之後的內容)
+            content = main_content.text_content().partition('\n--\n')[0]
             
             result['content'] = content.strip()
     
@@ -122,7 +172,7 @@ def extract_article_id(url: str) -> str:
     Example:
         https://www.ptt.cc/bbs/Loan/M.1701234567.A.123.html -> M.1701234567.A.123
     """
-    match = re.search(r'/([A-Z]\.\d+\.[A-Z]\.[A-Z0-9]+)\.html', url)
+    match = _ARTICLE_ID_RE.search(url)
     return match.group(1) if match else ''
 
 
@@ -133,54 +183,73 @@ def parse_ptt_datetime(datetime_str: str) -> Optional[datetime]:
     Example:
         'Fri Dec  6 01:23:45 2024' -> datetime object
     """
+    # PTT 時間格式: Wed Dec  4 12:34:56 2024 (個位數日期前會多一個空白)
+    normalized = _WHITESPACE_RE.sub(' ', datetime_str.strip())
     try:
-        # PTT 時間格式: Wed Dec  4 12:34:56 2024
-        dt = datetime.strptime(datetime_str, '%a %b %d %H:%M:%S %Y')
-        # 設定為台北時區
-        tz = pytz.timezone(settings.TIMEZONE)
-        return tz.localize(dt)
+        dt = datetime.strptime(normalized, _PTT_DATETIME_FORMAT)
     except ValueError:
-        try:
-            # 嘗試其他可能的格式
-            dt = datetime.strptime(datetime_str, '%a %b  %d %H:%M:%S %Y')
-            tz = pytz.timezone(settings.TIMEZONE)
-            return tz.localize(dt)
-        except ValueError:
-            return None
+        return None
+    # 設定為台北時區
+    return dt.replace(tzinfo=_TZ)
+
+
+@lru_cache(maxsize=8)
+def _compile_keyword_pattern(keywords: tuple[str, ...]) -> Optional[re.Pattern]:
+    """
+    將關鍵字編譯成單一正規表示式 (同一組關鍵字只編譯一次)
+    
+    Returns:
+        編譯後的 pattern，沒有有效關鍵字時回傳 None
+    """
+    keywords = set(k for k in keywords if k)
+    if not keywords:
+        return None
+
+    # 只需要比對是否命中，包含其他關鍵字的長關鍵字 (如「個人信貸」含「信貸」) 可以省略
+    keywords = sorted(
+        (k for k in keywords if not any(other != k and other in k for other in keywords)),
+        key=lambda k: (len(k), k)
+    )
+    return re.compile('|'.join(re.escape(k) for k in keywords))
 
 
-def filter_by_keywords(articles: list[Dict[str, Any]], keywords: list[str]) -> list[Dict[str, Any]]:
+def filter_by_keywords(articles: list[ArticleRecord], 
+                       keywords: Optional[list[str]] = None) -> list[ArticleRecord]:
     """
     根據關鍵字過濾文章
     
     Args:
         articles: 文章列表
-        keywords: 關鍵字列表
+        keywords: 關鍵字列表，預設使用設定中的關鍵字
         
     Returns:
         包含任一關鍵字的文章列表
     """
-    filtered = []
-    for article in articles:
-        title = article.get('title', '')
-        for keyword in keywords:
-            if keyword in title:
-                filtered.append(article)
-                break
-    return filtered
+    if keywords is None:
+        keywords = settings.keywords_list
+    pattern = _compile_keyword_pattern(tuple(keywords))
+    if pattern is None:
+        return []
+    return [article for article in articles if pattern.search(article.title)]
 
 
 def get_previous_page_url(html: str) -> Optional[str]:
     """
     取得上一頁的 URL
     """
-    soup = BeautifulSoup(html, 'lxml')
-    
-    # 找到 "上頁" 連結
-    for link in soup.select('div.btn-group-paging a'):
-        if '上頁' in link.get_text():
-            href = link.get('href', '')
-            if href:
-                return f"https://www.ptt.cc{href}"
+    # 直接在原始 HTML 中尋找 "上頁" 連結，不需要建立整棵 DOM
+    match = _PREV_PAGE_RE.search(html)
+    if match:
+        return f"https://www.ptt.cc{match.group(1)}"
+    
+    # 版面變動時改用 XPath 解析
+    try:
+        root = lxml.html.fromstring(html)
+    except (etree.ParserError, ValueError):
+        return None
+    
+    for href in _PREV_PAGE_XP(root):
+        if href:
+            return f"https://www.ptt.cc{href}"
     
     return None
@@ -1,38 +1,114 @@
+import atexit
 import requests
-import random
 import time
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from dataclasses import replace
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Dict, Any, Optional
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from config import settings
 from .parser import (
+    ArticleRecord,
     parse_article_list, 
     parse_article_content, 
     filter_by_keywords,
     get_previous_page_url
 )
 
-# 設定 logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+class RateLimiter:
+    """Token bucket 限流器 (執行緒安全)"""
+    
+    def __init__(self, rate_per_minute: float, capacity: int = 1):
+        """
+        Args:
+            rate_per_minute: 每分鐘補充的 token 數，小於等於 0 表示不限流
+            capacity: bucket 容量，即允許的瞬間請求數
+        """
+        self.rate = rate_per_minute / 60
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """取得一個 token，不足時等待到補充為止"""
+        if self.rate <= 0:
+            return
+        
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
 class PTTScraper:
     """PTT 爬蟲類別"""
     
-    def __init__(self):
+    def __init__(self, seen_capacity: int = 2000):
         self.session = requests.Session()
         # 設定必要的 cookie 以繞過年齡驗證
         self.session.cookies.set('over18', '1', domain='.ptt.cc')
         # 設定 User-Agent
         self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            'Connection': 'keep-alive'
         })
+        # 連線池：重複使用 TCP/TLS 連線，並對暫時性錯誤自動重試
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=max(settings.CRAWLER_MAX_CONCURRENCY, 10),
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=['GET']
+            )
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # 限制對 PTT 的請求速率，避免過於頻繁的請求
+        self.rate_limiter = RateLimiter(
+            rate_per_minute=settings.CRAWLER_RATE_PER_MINUTE,
+            capacity=settings.CRAWLER_MAX_CONCURRENCY
+        )
+        
+        # 已存入資料庫的文章 ID (只保留最近的 seen_capacity 筆)，避免重複抓取內容
+        self._seen: OrderedDict[str, None] = OrderedDict()
+        self._seen_capacity = seen_capacity
+        self._seen_lock = threading.Lock()
+    
+    def close(self):
+        """關閉 HTTP session 與連線池"""
+        self.session.close()
     
-    def _random_delay(self, min_sec: float = 1.0, max_sec: float = 3.0):
-        """隨機延遲，避免過於頻繁的請求"""
-        delay = random.uniform(min_sec, max_sec)
-        time.sleep(delay)
+    def mark_seen(self, article_ids: Iterable[str]):
+        """
+        記錄已處理過的文章，之後抓取時不再下載其內容
+        
+        Args:
+            article_ids: PTT 文章 ID
+        """
+        with self._seen_lock:
+            for article_id in article_ids:
+                self._seen[article_id] = None
+                self._seen.move_to_end(article_id)
+            while len(self._seen) > self._seen_capacity:
+                self._seen.popitem(last=False)
     
     def fetch_page(self, url: str) -> Optional[str]:
         """
@@ -44,15 +120,16 @@ class PTTScraper:
         Returns:
             頁面 HTML 內容，失敗回傳 None
         """
+        self.rate_limiter.acquire()
         try:
             response = self.session.get(url, timeout=10)
             response.raise_for_status()
             return response.text
         except requests.RequestException as e:
-            logger.error(f"抓取頁面失敗 {url}: {e}")
+            logger.error("抓取頁面失敗 %s: %s", url, e)
             return None
     
-    def get_article_list(self, url: str = None) -> List[Dict[str, Any]]:
+    def get_article_list(self, url: str = None) -> List[ArticleRecord]:
         """
         取得文章列表
         
@@ -81,15 +158,30 @@ class PTTScraper:
         Returns:
             文章內容資訊
         """
-        self._random_delay(0.5, 1.5)  # 減少延遲以加快抓取速度
-        
         html = self.fetch_page(url)
         if not html:
             return {}
         
         return parse_article_content(html)
     
-    def get_filtered_articles(self, pages: int = 1) -> List[Dict[str, Any]]:
+    def get_article_contents(self, urls: List[str]) -> List[Dict[str, Any]]:
+        """
+        並行取得多篇文章內容
+        
+        Args:
+            urls: 文章 URL 列表
+            
+        Returns:
+            文章內容資訊列表，順序與 urls 相同
+        """
+        max_workers = min(max(settings.CRAWLER_MAX_CONCURRENCY, 1), len(urls))
+        if max_workers <= 1:
+            return [self.get_article_content(url) for url in urls]
+        
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ptt-fetch') as executor:
+            return list(executor.map(self.get_article_content, urls))
+    
+    def get_filtered_articles(self, pages: int = 1) -> List[ArticleRecord]:
         """
         取得符合關鍵字的文章列表
         
@@ -101,40 +193,48 @@ class PTTScraper:
         """
         all_articles = []
         current_url = settings.PTT_BOARD_URL
-        keywords = settings.keywords_list
+        pages_fetched = 0
+        matched_count = 0
         
         for page_num in range(pages):
-            logger.info(f"正在抓取第 {page_num + 1} 頁: {current_url}")
+            logger.debug("正在抓取第 %d 頁: %s", page_num + 1, current_url)
             
             # 取得文章列表
             html = self.fetch_page(current_url)
             if not html:
                 break
             
+            pages_fetched += 1
             articles = parse_article_list(html)
             
             # 過濾符合關鍵字的文章
-            filtered = filter_by_keywords(articles, keywords)
-            logger.info(f"找到 {len(filtered)} 篇符合關鍵字的文章")
+            filtered = filter_by_keywords(articles)
+            matched_count += len(filtered)
             
-            # 抓取每篇文章的完整內容
-            for article in filtered:
-                content_data = self.get_article_content(article['url'])
-                article.update(content_data)
-                all_articles.append(article)
+            # 略過已處理過的文章，不重複抓取內容
+            with self._seen_lock:
+                filtered = [a for a in filtered if a.article_id not in self._seen]
+            
+            # 並行抓取每篇文章的完整內容
+            contents = self.get_article_contents([article.url for article in filtered])
+            for article, content_data in zip(filtered, contents):
+                all_articles.append(replace(article, **content_data))
             
             # 取得上一頁連結
             if page_num < pages - 1:
                 prev_url = get_previous_page_url(html)
                 if prev_url:
                     current_url = prev_url
-                    self._random_delay()
                 else:
                     break
         
+        logger.info(
+            "抓取 %d 頁，%d 篇符合關鍵字，其中 %d 篇為尚未處理的文章",
+            pages_fetched, matched_count, len(all_articles)
+        )
         return all_articles
     
-    def get_new_articles(self) -> List[Dict[str, Any]]:
+    def get_new_articles(self) -> List[ArticleRecord]:
         """
         只抓取最新一頁的符合關鍵字文章
         適用於定時任務，每分鐘檢查一次
@@ -147,10 +247,18 @@ class PTTScraper:
 
 # 建立全域 scraper 實例
 scraper = PTTScraper()
+atexit.register(scraper.close)
 
 
-def crawl_new_articles() -> List[Dict[str, Any]]:
+def crawl_new_articles() -> List[ArticleRecord]:
     """
     便捷函數：抓取新文章
     """
     return scraper.get_new_articles()
+
+
+def mark_articles_seen(article_ids: Iterable[str]):
+    """
+    便捷函數：記錄已存入資料庫的文章，之後的抓取會略過
+    """
+    scraper.mark_seen(article_ids)
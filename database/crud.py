@@ -1,13 +1,15 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, contains_eager, selectinload
+from sqlalchemy import and_, or_, exists, func, insert, select, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from datetime import datetime, timedelta
-from typing import List, Optional
-import pytz
+from typing import List, Optional, Tuple
 
 from .models import Article, User, Notification, UserTier
 from config import settings
 
 
+# 寫入函式 (create_*, update_*, mark_*, delete_*) 都不 commit，由呼叫端在工作單元結束時 commit
+
 # ==================== Article CRUD ====================
 
 def get_article_by_ptt_id(db: Session, article_id: str) -> Optional[Article]:
@@ -27,33 +29,57 @@ def create_article(db: Session, article_id: str, title: str, author: str,
         post_time=post_time
     )
     db.add(db_article)
-    db.commit()
-    db.refresh(db_article)
+    db.flush()
     return db_article
 
 
+def bulk_create_articles(db: Session, rows: List[dict]) -> List[Article]:
+    """
+    批次建立文章，已存在的文章 (article_id 重複) 會被略過
+    
+    Args:
+        rows: 文章欄位 dict 列表 (article_id, title, author, content, url, post_time)
+        
+    Returns:
+        實際新增的文章列表
+    """
+    if not rows:
+        return []
+    
+    stmt = (
+        pg_insert(Article)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=[Article.article_id])
+        .returning(Article)
+    )
+    return list(db.scalars(stmt))
+
+
+def _retention_cutoff() -> datetime:
+    """
+    計算資料保留期限的截止時間
+    
+    created_at 以 naive UTC (datetime.utcnow) 儲存，截止時間也必須是 naive UTC 才能正確比較
+    """
+    return datetime.utcnow() - timedelta(days=settings.RETENTION_DAYS)
+
+
 def get_articles_to_delete(db: Session) -> List[Article]:
     """取得超過保留期限的文章"""
-    tz = pytz.timezone(settings.TIMEZONE)
-    cutoff_date = datetime.now(tz) - timedelta(days=settings.RETENTION_DAYS)
-    return db.query(Article).filter(Article.created_at < cutoff_date).all()
+    return db.query(Article).filter(Article.created_at < _retention_cutoff()).all()
 
 
 def delete_old_articles(db: Session) -> int:
     """刪除超過保留期限的文章，回傳刪除數量"""
-    tz = pytz.timezone(settings.TIMEZONE)
-    cutoff_date = datetime.now(tz) - timedelta(days=settings.RETENTION_DAYS)
+    cutoff_date = _retention_cutoff()
+    old_article_ids = select(Article.id).where(Article.created_at < cutoff_date)
     
     # 先刪除相關的通知記錄
-    old_articles = db.query(Article).filter(Article.created_at < cutoff_date).all()
-    article_ids = [a.id for a in old_articles]
-    
-    if article_ids:
-        db.query(Notification).filter(Notification.article_id.in_(article_ids)).delete(synchronize_session=False)
-        count = db.query(Article).filter(Article.id.in_(article_ids)).delete(synchronize_session=False)
-        db.commit()
-        return count
-    return 0
+    db.query(Notification).filter(
+        Notification.article_id.in_(old_article_ids)
+    ).delete(synchronize_session=False)
+    count = db.query(Article).filter(Article.created_at < cutoff_date).delete(synchronize_session=False)
+    return count
 
 
 # ==================== User CRUD ====================
@@ -71,8 +97,7 @@ def create_user(db: Session, line_user_id: str, tier: UserTier = UserTier.STANDA
         is_active=True
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    db.flush()
     return db_user
 
 
@@ -101,8 +126,7 @@ def update_user_tier(db: Session, line_user_id: str, tier: UserTier) -> Optional
     user = get_user_by_line_id(db, line_user_id)
     if user:
         user.tier = tier
-        db.commit()
-        db.refresh(user)
+        db.flush()
     return user
 
 
@@ -116,27 +140,74 @@ def create_notification(db: Session, user_id: int, article_id: int) -> Notificat
         sent_at=None
     )
     db.add(db_notification)
-    db.commit()
-    db.refresh(db_notification)
+    db.flush()
     return db_notification
 
 
+def create_sent_notifications_bulk(db: Session, pairs: List[Tuple[int, int]]) -> None:
+    """
+    批次建立已發送的通知記錄
+    
+    Args:
+        pairs: (user_id, article_id) 列表
+    """
+    if not pairs:
+        return
+    
+    sent_at = datetime.utcnow()
+    db.execute(
+        insert(Notification),
+        [{"user_id": user_id, "article_id": article_id, "sent_at": sent_at} for user_id, article_id in pairs]
+    )
+
+
+def create_pending_notifications_bulk(db: Session, article_ids: List[int], 
+                                      tier: UserTier = UserTier.STANDARD) -> int:
+    """
+    為指定等級的所有啟用用戶批次建立待發送通知，已有通知記錄的組合會被略過
+    
+    Returns:
+        新增的通知數量
+    """
+    if not article_ids:
+        return 0
+    
+    # users × articles 的交叉組合，再排除已存在的通知
+    pairs = select(User.id, Article.id).join(Article, true()).where(
+        and_(
+            User.tier == tier,
+            User.is_active == True,
+            Article.id.in_(article_ids),
+            ~exists().where(
+                and_(Notification.user_id == User.id, Notification.article_id == Article.id)
+            )
+        )
+    )
+    result = db.execute(insert(Notification).from_select(["user_id", "article_id"], pairs))
+    return result.rowcount
+
+
 def get_pending_notifications_for_user(db: Session, user_id: int) -> List[Notification]:
-    """取得用戶的待發送通知"""
-    return db.query(Notification).filter(
+    """取得用戶的待發送通知 (一併載入文章)"""
+    return db.query(Notification).options(
+        selectinload(Notification.article)
+    ).filter(
         and_(Notification.user_id == user_id, Notification.sent_at == None)
     ).all()
 
 
 def get_pending_notifications_for_standard_users(db: Session) -> List[Notification]:
-    """取得所有 Standard 用戶的待發送通知"""
-    return db.query(Notification).join(User).filter(
+    """取得所有 Standard 用戶的待發送通知 (一併載入用戶與文章，依用戶排序)"""
+    return db.query(Notification).join(Notification.user).options(
+        contains_eager(Notification.user),
+        selectinload(Notification.article)
+    ).filter(
         and_(
             Notification.sent_at == None,
             User.tier == UserTier.STANDARD,
             User.is_active == True
         )
-    ).all()
+    ).order_by(Notification.user_id, Notification.id).all()
 
 
 def mark_notification_sent(db: Session, notification_id: int) -> None:
@@ -144,16 +215,17 @@ def mark_notification_sent(db: Session, notification_id: int) -> None:
     notification = db.query(Notification).filter(Notification.id == notification_id).first()
     if notification:
         notification.sent_at = datetime.utcnow()
-        db.commit()
+        db.flush()
 
 
 def mark_notifications_sent(db: Session, notification_ids: List[int]) -> None:
-    """批次標記通知為已發送"""
+    """批次標記通知為已發送 (單一 UPDATE)"""
+    if not notification_ids:
+        return
     db.query(Notification).filter(Notification.id.in_(notification_ids)).update(
         {"sent_at": datetime.utcnow()},
         synchronize_session=False
     )
-    db.commit()
 
 
 def has_notification_for_article(db: Session, user_id: int, article_id: int) -> bool:
@@ -161,3 +233,19 @@ def has_notification_for_article(db: Session, user_id: int, article_id: int) ->
     return db.query(Notification).filter(
         and_(Notification.user_id == user_id, Notification.article_id == article_id)
     ).first() is not None
+
+
+# ==================== 統計 ====================
+
+def get_stats(db: Session) -> dict:
+    """以單一查詢取得文章數、啟用用戶數與待發送通知數"""
+    row = db.execute(
+        select(
+            select(func.count()).select_from(Article).scalar_subquery().label('total_articles'),
+            select(func.count()).select_from(User)
+            .where(User.is_active == True).scalar_subquery().label('total_users'),
+            select(func.count()).select_from(Notification)
+            .where(Notification.sent_at.is_(None)).scalar_subquery().label('pending_notifications')
+        )
+    ).one()
+    return dict(row._mapping)
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Enum as SQLEnum
+from sqlalchemy import create_engine, text, Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Index, Enum as SQLEnum
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -12,8 +12,17 @@ db_url = settings.DATABASE_URL
 if db_url.startswith("postgresql://"):
     db_url = db_url.replace("postgresql://", "postgresql+psycopg://", 1)
 
-engine = create_engine(db_url, echo=False)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 連線池：排程任務每分鐘都會開啟 session，保持連線並在使用前檢查是否失效
+engine = create_engine(
+    db_url,
+    echo=False,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=1800
+)
+# commit 後不讓物件過期，避免存取屬性時再逐筆 SELECT
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 Base = declarative_base()
 
 
@@ -34,7 +43,7 @@ class Article(Base):
     content = Column(Text, nullable=True)  # 完整內容
     url = Column(String(255), nullable=False)  # 文章連結
     post_time = Column(DateTime, nullable=True)  # 發文時間
-    created_at = Column(DateTime, default=datetime.utcnow)  # 抓取時間
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)  # 抓取時間 (UTC)
     
     # 關聯
     notifications = relationship("Notification", back_populates="article")
@@ -46,6 +55,10 @@ class Article(Base):
 class User(Base):
     """用戶模型"""
     __tablename__ = "users"
+    __table_args__ = (
+        # 只索引啟用中的用戶，供依等級查詢
+        Index("ix_users_tier_active", "tier", postgresql_where=text("is_active")),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     line_user_id = Column(String(50), unique=True, index=True, nullable=False)  # LINE User ID
@@ -63,6 +76,14 @@ class User(Base):
 class Notification(Base):
     """通知記錄模型"""
     __tablename__ = "notifications"
+    __table_args__ = (
+        # 同一用戶同一篇文章只會有一筆通知
+        Index("ix_notifications_user_article", "user_id", "article_id", unique=True),
+        # 只索引待發送的通知，查詢成本與待發送數量成正比
+        Index("ix_notifications_pending", "user_id", postgresql_where=text("sent_at IS NULL")),
+        # 清理舊文章時依 article_id 刪除通知，以及檢查文章的 foreign key
+        Index("ix_notifications_article_id", "article_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -81,12 +102,14 @@ class Notification(Base):
 def init_db():
     """初始化資料庫，建立所有表格"""
     Base.metadata.create_all(bind=engine)
+    
+    # create_all 不會替已存在的表格補建索引，逐一檢查後建立
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 
 def get_db():
     """取得資料庫 session"""
-    db = SessionLocal()
-    try:
+    with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -1,9 +1,10 @@
 import logging
 from contextlib import asynccontextmanager
+from zoneinfo import ZoneInfo
 
-import pytz
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Query
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
@@ -21,8 +22,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# APScheduler 實例
-scheduler = AsyncIOScheduler(timezone=pytz.timezone(settings.TIMEZONE))
+# APScheduler 實例 (任務不可重入；延誤累積的多次觸發只執行一次)
+scheduler = AsyncIOScheduler(
+    timezone=ZoneInfo(settings.TIMEZONE),
+    job_defaults={'coalesce': True, 'max_instances': 1}
+)
 
 
 @asynccontextmanager
@@ -40,6 +44,7 @@ async def lifespan(app: FastAPI):
         IntervalTrigger(minutes=settings.SCHEDULE_INTERVAL_MINUTES),
         id='crawl_job',
         name='PTT 爬蟲任務',
+        misfire_grace_time=30,
         replace_existing=True
     )
     
@@ -49,6 +54,7 @@ async def lifespan(app: FastAPI):
         CronTrigger(minute=0),  # 每小時整點
         id='hourly_notification_job',
         name='Standard 用戶通知任務',
+        misfire_grace_time=300,
         replace_existing=True
     )
     
@@ -58,13 +64,14 @@ async def lifespan(app: FastAPI):
         CronTrigger(hour=3, minute=0),
         id='cleanup_job',
         name='清理舊文章任務',
+        misfire_grace_time=3600,  # 延誤一小時內仍會補執行
         replace_existing=True
     )
     
     scheduler.start()
     logger.info("排程器已啟動")
-    logger.info(f"排程時間: {settings.SCHEDULE_START_HOUR}:00 - {settings.SCHEDULE_END_HOUR}:00")
-    logger.info(f"抓取間隔: 每 {settings.SCHEDULE_INTERVAL_MINUTES} 分鐘")
+    logger.info("排程時間: %d:00 - %d:00", settings.SCHEDULE_START_HOUR, settings.SCHEDULE_END_HOUR)
+    logger.info("抓取間隔: 每 %d 分鐘", settings.SCHEDULE_INTERVAL_MINUTES)
     
     yield
     
@@ -98,26 +105,18 @@ async def health_check():
     return {"status": "healthy"}
 
 
-@app.post("/trigger")
-async def trigger_crawl():
-    """手動觸發爬蟲 (測試用)"""
-    try:
-        crawl_and_notify()
-        return {"status": "success", "message": "爬蟲任務已執行"}
-    except Exception as e:
-        logger.error(f"手動觸發失敗: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+@app.post("/trigger", status_code=202)
+async def trigger_crawl(background_tasks: BackgroundTasks):
+    """手動觸發爬蟲 (測試用)，任務在背景執行"""
+    background_tasks.add_task(crawl_and_notify)
+    return {"status": "accepted", "message": "爬蟲任務已排入背景執行"}
 
 
-@app.post("/trigger/hourly")
-async def trigger_hourly_notification():
-    """手動觸發 Standard 用戶通知 (測試用)"""
-    try:
-        send_hourly_notifications()
-        return {"status": "success", "message": "通知任務已執行"}
-    except Exception as e:
-        logger.error(f"手動觸發失敗: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+@app.post("/trigger/hourly", status_code=202)
+async def trigger_hourly_notification(background_tasks: BackgroundTasks):
+    """手動觸發 Standard 用戶通知 (測試用)，任務在背景執行"""
+    background_tasks.add_task(send_hourly_notifications)
+    return {"status": "accepted", "message": "通知任務已排入背景執行"}
 
 
 @app.get("/jobs")
@@ -142,6 +141,41 @@ async def line_webhook_verify():
     """LINE Webhook 驗證用 (GET)"""
     return {"status": "ok"}
 
+
+def _handle_line_events(db: Session, events: list) -> None:
+    """處理 LINE 事件：自動註冊用戶並回覆訊息 (同步 I/O，需在 threadpool 中執行)"""
+    from notification.line_bot import push_message_to_user
+    
+    for event in events:
+        # 取得用戶 ID
+        user_id = event.get('source', {}).get('userId')
+        if user_id:
+            # 自動註冊用戶（如果不存在）
+            user = crud.get_or_create_user(db, user_id, UserTier.STANDARD)
+            db.commit()
+            logger.info("用戶已註冊/確認: %s, 等級: %s", user_id, user.tier.value)
+            
+            # 如果是訊息事件，回覆歡迎訊息
+            event_type = event.get('type')
+            if event_type == 'follow':
+                # 新加入好友
+                push_message_to_user(
+                    user_id,
+                    "🎉 歡迎加入 PTT 信貸通知！\n\n"
+                    "您已被設為 Standard 會員，將於每小時收到通知。\n"
+                    f"您的 User ID: {user_id}"
+                )
+            elif event_type == 'message':
+                # 用戶發送訊息
+                push_message_to_user(
+                    user_id,
+                    f"✅ 您已註冊成功！\n\n"
+                    f"會員等級: {user.tier.value.upper()}\n"
+                    f"User ID: {user_id}\n\n"
+                    "當有信貸相關文章時，您會收到通知！"
+                )
+
+
 @app.post("/webhook")
 async def line_webhook(
     request: Request,
@@ -157,54 +191,27 @@ async def line_webhook(
         import json
         events = json.loads(body_text).get('events', [])
         
-        for event in events:
-            # 取得用戶 ID
-            user_id = event.get('source', {}).get('userId')
-            if user_id:
-                # 自動註冊用戶（如果不存在）
-                user = crud.get_or_create_user(db, user_id, UserTier.STANDARD)
-                logger.info(f"用戶已註冊/確認: {user_id}, 等級: {user.tier.value}")
-                
-                # 如果是訊息事件，回覆歡迎訊息
-                event_type = event.get('type')
-                if event_type == 'follow':
-                    # 新加入好友
-                    from notification.line_bot import push_message_to_user
-                    push_message_to_user(
-                        user_id,
-                        "🎉 歡迎加入 PTT 信貸通知！\n\n"
-                        "您已被設為 Standard 會員，將於每小時收到通知。\n"
-                        f"您的 User ID: {user_id}"
-                    )
-                elif event_type == 'message':
-                    # 用戶發送訊息
-                    from notification.line_bot import push_message_to_user
-                    push_message_to_user(
-                        user_id,
-                        f"✅ 您已註冊成功！\n\n"
-                        f"會員等級: {user.tier.value.upper()}\n"
-                        f"User ID: {user_id}\n\n"
-                        "當有信貸相關文章時，您會收到通知！"
-                    )
+        # 資料庫與 LINE API 皆為阻塞 I/O，移到 threadpool 避免卡住 event loop
+        await run_in_threadpool(_handle_line_events, db, events)
         
         return {"status": "ok"}
     except Exception as e:
-        logger.error(f"Webhook 處理錯誤: {e}")
+        logger.error("Webhook 處理錯誤: %s", e)
         return {"status": "error", "message": str(e)}
 
 
 # ==================== 用戶管理 API ====================
 
 @app.post("/users")
-async def add_user(
+def add_user(
     line_user_id: str = Query(..., description="LINE User ID"),
-    tier: str = Query("standard", description="用戶等級: premium 或 standard"),
+    tier: UserTier = Query(UserTier.STANDARD, description="用戶等級: premium 或 standard"),
     db: Session = Depends(get_db)
 ):
     """新增用戶"""
     try:
-        user_tier = UserTier.PREMIUM if tier.lower() == "premium" else UserTier.STANDARD
-        user = crud.get_or_create_user(db, line_user_id, user_tier)
+        user = crud.get_or_create_user(db, line_user_id, tier)
+        db.commit()
         return {
             "status": "success",
             "user": {
@@ -219,17 +226,17 @@ async def add_user(
 
 
 @app.put("/users/{line_user_id}/tier")
-async def update_user_tier(
+def update_user_tier(
     line_user_id: str,
-    tier: str = Query(..., description="用戶等級: premium 或 standard"),
+    tier: UserTier = Query(..., description="用戶等級: premium 或 standard"),
     db: Session = Depends(get_db)
 ):
     """更新用戶等級"""
-    user_tier = UserTier.PREMIUM if tier.lower() == "premium" else UserTier.STANDARD
-    user = crud.update_user_tier(db, line_user_id, user_tier)
+    user = crud.update_user_tier(db, line_user_id, tier)
     
     if not user:
         raise HTTPException(status_code=404, detail="用戶不存在")
+    db.commit()
     
     return {
         "status": "success",
@@ -242,7 +249,7 @@ async def update_user_tier(
 
 
 @app.get("/users")
-async def list_users(db: Session = Depends(get_db)):
+def list_users(db: Session = Depends(get_db)):
     """列出所有用戶"""
     users = crud.get_all_active_users(db)
     return {
@@ -261,25 +268,15 @@ async def list_users(db: Session = Depends(get_db)):
 # ==================== 統計 API ====================
 
 @app.get("/stats")
-async def get_stats(db: Session = Depends(get_db)):
+def get_stats(db: Session = Depends(get_db)):
     """取得系統統計"""
-    from database.models import Article, User, Notification
-    
-    total_articles = db.query(Article).count()
-    total_users = db.query(User).filter(User.is_active == True).count()
-    pending_notifications = db.query(Notification).filter(Notification.sent_at == None).count()
-    
-    return {
-        "total_articles": total_articles,
-        "total_users": total_users,
-        "pending_notifications": pending_notifications
-    }
+    return crud.get_stats(db)
 
 
 # ==================== 測試 API ====================
 
 @app.post("/test-notification")
-async def test_notification(
+def test_notification(
     line_user_id: str = Query(..., description="LINE User ID"),
     db: Session = Depends(get_db)
 ):
@@ -301,4 +298,4 @@ async def test_notification(
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=8000, access_log=False)
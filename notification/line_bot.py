@@ -1,6 +1,8 @@
 import logging
-from typing import List, Optional
-from datetime import datetime
+from functools import lru_cache
+from typing import List, Optional, Union
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
 
 from linebot.v3 import WebhookHandler
 from linebot.v3.messaging import (
@@ -10,20 +12,89 @@ from linebot.v3.messaging import (
     PushMessageRequest,
     TextMessage,
     FlexMessage,
-    FlexContainer
+    FlexBubble,
+    FlexCarousel
 )
 from linebot.v3.exceptions import InvalidSignatureError
 
 from config import settings
 
-# 設定 logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # LINE Bot 設定
 configuration = Configuration(access_token=settings.LINE_CHANNEL_TOKEN)
+# 連線池需足以支援排程任務的並行推播
+configuration.connection_pool_maxsize = max(
+    configuration.connection_pool_maxsize or 0, settings.LINE_PUSH_CONCURRENCY
+)
 handler = WebhookHandler(settings.LINE_CHANNEL_SECRET)
 
+# 共用的 API client，所有推播重複使用同一組 keep-alive 連線
+api_client = ApiClient(configuration)
+line_bot_api = MessagingApi(api_client)
+
+
+# 通知顯示用的時區
+_TZ = ZoneInfo(settings.TIMEZONE)
+
+# Flex Message 中固定不變的部分，只建立一次並在每則訊息間共用
+_BUBBLE_HEADER = {
+    "type": "box",
+    "layout": "vertical",
+    "contents": [
+        {
+            "type": "text",
+            "text": "📢 PTT 信貸通知",
+            "weight": "bold",
+            "color": "#1DB446",
+            "size": "sm"
+        }
+    ],
+    "paddingBottom": "8px"
+}
+
+_AUTHOR_LABEL = {
+    "type": "text",
+    "text": "作者",
+    "color": "#aaaaaa",
+    "size": "sm",
+    "flex": 1
+}
+
+_TIME_LABEL = {
+    "type": "text",
+    "text": "時間",
+    "color": "#aaaaaa",
+    "size": "sm",
+    "flex": 1
+}
+
+
+def _format_post_time(post_time: Optional[datetime]) -> str:
+    """將發文時間轉為台北時區的顯示字串"""
+    if not post_time:
+        return "未知時間"
+    
+    if post_time.tzinfo is None:
+        # 如果沒有時區資訊，假設是 UTC，轉換為台北時間
+        post_time = post_time.replace(tzinfo=timezone.utc).astimezone(_TZ)
+    else:
+        # 如果有時區資訊，直接轉換
+        post_time = post_time.astimezone(_TZ)
+    return post_time.strftime("%Y/%m/%d %H:%M")
+
+
+def _value_text(text: str) -> dict:
+    """作者、時間欄位的值"""
+    return {
+        "type": "text",
+        "text": text,
+        "wrap": True,
+        "color": "#666666",
+        "size": "sm",
+        "flex": 4
+    }
+
 
 def create_article_flex_message(title: str, author: str, url: str, post_time: Optional[datetime] = None) -> dict:
     """
@@ -36,41 +107,12 @@ def create_article_flex_message(title: str, author: str, url: str, post_time: Op
         post_time: 發文時間
         
     Returns:
-        Flex Message JSON
+        Flex Message JSON (固定的區塊為共用物件，請勿修改)
     """
-    import pytz
-    from config import settings
-    
-    if post_time:
-        # 確保時間以台北時區顯示
-        tz = pytz.timezone(settings.TIMEZONE)
-        if post_time.tzinfo is None:
-            # 如果沒有時區資訊，假設是 UTC，轉換為台北時間
-            post_time = pytz.utc.localize(post_time).astimezone(tz)
-        else:
-            # 如果有時區資訊，直接轉換
-            post_time = post_time.astimezone(tz)
-        time_str = post_time.strftime("%Y/%m/%d %H:%M")
-    else:
-        time_str = "未知時間"
-    
     return {
         "type": "bubble",
         "size": "kilo",
-        "header": {
-            "type": "box",
-            "layout": "vertical",
-            "contents": [
-                {
-                    "type": "text",
-                    "text": "📢 PTT 信貸通知",
-                    "weight": "bold",
-                    "color": "#1DB446",
-                    "size": "sm"
-                }
-            ],
-            "paddingBottom": "8px"
-        },
+        "header": _BUBBLE_HEADER,
         "body": {
             "type": "box",
             "layout": "vertical",
@@ -93,45 +135,13 @@ def create_article_flex_message(title: str, author: str, url: str, post_time: Op
                             "type": "box",
                             "layout": "baseline",
                             "spacing": "sm",
-                            "contents": [
-                                {
-                                    "type": "text",
-                                    "text": "作者",
-                                    "color": "#aaaaaa",
-                                    "size": "sm",
-                                    "flex": 1
-                                },
-                                {
-                                    "type": "text",
-                                    "text": author,
-                                    "wrap": True,
-                                    "color": "#666666",
-                                    "size": "sm",
-                                    "flex": 4
-                                }
-                            ]
+                            "contents": [_AUTHOR_LABEL, _value_text(author)]
                         },
                         {
                             "type": "box",
                             "layout": "baseline",
                             "spacing": "sm",
-                            "contents": [
-                                {
-                                    "type": "text",
-                                    "text": "時間",
-                                    "color": "#aaaaaa",
-                                    "size": "sm",
-                                    "flex": 1
-                                },
-                                {
-                                    "type": "text",
-                                    "text": time_str,
-                                    "wrap": True,
-                                    "color": "#666666",
-                                    "size": "sm",
-                                    "flex": 4
-                                }
-                            ]
+                            "contents": [_TIME_LABEL, _value_text(_format_post_time(post_time))]
                         }
                     ]
                 }
@@ -159,7 +169,27 @@ def create_article_flex_message(title: str, author: str, url: str, post_time: Op
     }
 
 
-def create_batch_flex_message(articles: List[dict]) -> dict:
+@lru_cache(maxsize=256)
+def _article_bubble(title: str, author: str, url: str, post_time: Optional[datetime] = None) -> FlexBubble:
+    """
+    取得文章通知的 FlexBubble (同一篇文章只轉換一次)
+    
+    同一篇文章會推播給多位用戶，快取轉換後的 model 可避免每次推播都重新驗證整個 Flex 結構
+    """
+    return FlexBubble.from_dict(create_article_flex_message(title, author, url, post_time))
+
+
+def _batch_article_bubble(article: dict) -> FlexBubble:
+    """以批次通知的文章資料取得快取的 FlexBubble"""
+    return _article_bubble(
+        article.get('title', ''),
+        article.get('author', ''),
+        article.get('url', ''),
+        article.get('post_time')
+    )
+
+
+def create_batch_flex_message(articles: List[dict]) -> FlexCarousel:
     """
     建立批次通知的 Flex Message (用於 Standard 用戶)
     
@@ -167,22 +197,9 @@ def create_batch_flex_message(articles: List[dict]) -> dict:
         articles: 文章列表，每個元素包含 title, author, url, post_time
         
     Returns:
-        Flex Message JSON (carousel)
+        FlexCarousel，由快取的 bubble 組成 (最多 10 篇)
     """
-    bubbles = []
-    for article in articles[:10]:  # 最多 10 篇
-        bubble = create_article_flex_message(
-            title=article.get('title', ''),
-            author=article.get('author', ''),
-            url=article.get('url', ''),
-            post_time=article.get('post_time')
-        )
-        bubbles.append(bubble)
-    
-    return {
-        "type": "carousel",
-        "contents": bubbles
-    }
+    return FlexCarousel(contents=[_batch_article_bubble(article) for article in articles[:10]])
 
 
 def push_message_to_user(user_id: str, message: str) -> bool:
@@ -197,18 +214,42 @@ def push_message_to_user(user_id: str, message: str) -> bool:
         是否發送成功
     """
     try:
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            line_bot_api.push_message(
-                PushMessageRequest(
-                    to=user_id,
-                    messages=[TextMessage(text=message)]
-                )
+        line_bot_api.push_message(
+            PushMessageRequest(
+                to=user_id,
+                messages=[TextMessage(text=message)]
             )
-        logger.info(f"成功發送訊息給 {user_id}")
+        )
+        logger.debug("成功發送訊息給 %s", user_id)
+        return True
+    except Exception as e:
+        logger.error("發送訊息失敗: %s", e)
+        return False
+
+
+def _send_flex(user_id: str, flex_content: Union[FlexBubble, FlexCarousel], alt_text: str) -> bool:
+    """
+    發送 Flex Message 給用戶
+    
+    Args:
+        user_id: LINE User ID
+        flex_content: Flex 內容 (bubble 或 carousel)
+        alt_text: 不支援 Flex 時顯示的替代文字
+        
+    Returns:
+        是否發送成功
+    """
+    try:
+        line_bot_api.push_message(
+            PushMessageRequest(
+                to=user_id,
+                messages=[FlexMessage(alt_text=alt_text, contents=flex_content)]
+            )
+        )
+        logger.debug("成功發送通知給 %s: %s", user_id, alt_text)
         return True
     except Exception as e:
-        logger.error(f"發送訊息失敗: {e}")
+        logger.error("發送通知失敗: %s", e)
         return False
 
 
@@ -227,27 +268,11 @@ def push_article_notification(user_id: str, title: str, author: str, url: str,
     Returns:
         是否發送成功
     """
-    try:
-        flex_content = create_article_flex_message(title, author, url, post_time)
-        
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            line_bot_api.push_message(
-                PushMessageRequest(
-                    to=user_id,
-                    messages=[
-                        FlexMessage(
-                            alt_text=f"📢 PTT 信貸通知: {title}",
-                            contents=FlexContainer.from_dict(flex_content)
-                        )
-                    ]
-                )
-            )
-        logger.info(f"成功發送文章通知給 {user_id}: {title[:20]}...")
-        return True
-    except Exception as e:
-        logger.error(f"發送文章通知失敗: {e}")
-        return False
+    return _send_flex(
+        user_id,
+        _article_bubble(title, author, url, post_time),
+        f"📢 PTT 信貸通知: {title}"
+    )
 
 
 def push_batch_notification(user_id: str, articles: List[dict]) -> bool:
@@ -264,36 +289,18 @@ def push_batch_notification(user_id: str, articles: List[dict]) -> bool:
     if not articles:
         return True
     
-    try:
-        if len(articles) == 1:
-            # 只有一篇，使用單篇格式
-            article = articles[0]
-            return push_article_notification(
-                user_id,
-                article.get('title', ''),
-                article.get('author', ''),
-                article.get('url', ''),
-                article.get('post_time')
-            )
-        
-        # 多篇使用 carousel
-        flex_content = create_batch_flex_message(articles)
-        
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            line_bot_api.push_message(
-                PushMessageRequest(
-                    to=user_id,
-                    messages=[
-                        FlexMessage(
-                            alt_text=f"📢 PTT 信貸通知 ({len(articles)} 篇新文章)",
-                            contents=FlexContainer.from_dict(flex_content)
-                        )
-                    ]
-                )
-            )
-        logger.info(f"成功發送批次通知給 {user_id}: {len(articles)} 篇文章")
-        return True
-    except Exception as e:
-        logger.error(f"發送批次通知失敗: {e}")
-        return False
+    if len(articles) == 1:
+        # 只有一篇，使用單篇格式
+        article = articles[0]
+        return _send_flex(
+            user_id,
+            _batch_article_bubble(article),
+            f"📢 PTT 信貸通知: {article.get('title', '')}"
+        )
+    
+    # 多篇使用 carousel
+    return _send_flex(
+        user_id,
+        create_batch_flex_message(articles),
+        f"📢 PTT 信貸通知 ({len(articles)} 篇新文章)"
+    )
@@ -1,134 +1,210 @@
+import functools
 import logging
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List
+from typing import Any, Callable, List
+from zoneinfo import ZoneInfo
 
-import pytz
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
 from sqlalchemy.orm import Session
 
 from config import settings
-from database.models import SessionLocal, UserTier
+from database.models import SessionLocal, UserTier, engine
 from database import crud
-from crawler.ptt_scraper import crawl_new_articles
+from crawler.ptt_scraper import crawl_new_articles, mark_articles_seen
 from notification.line_bot import push_article_notification, push_batch_notification
 
-# 設定 logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_TZ = ZoneInfo(settings.TIMEZONE)
+
+# 排程任務 advisory lock 專用的 engine，不佔用一般連線池
+_lock_engine = (
+    create_engine(engine.url, poolclass=NullPool)
+    if engine.dialect.name == 'postgresql' else None
+)
+
 
 def is_within_schedule_hours() -> bool:
     """檢查目前時間是否在排程時間內 (07:00-20:00)"""
-    tz = pytz.timezone(settings.TIMEZONE)
-    now = datetime.now(tz)
-    return settings.SCHEDULE_START_HOUR <= now.hour < settings.SCHEDULE_END_HOUR
+    hour = datetime.now(_TZ).hour
+    return settings.SCHEDULE_START_HOUR <= hour < settings.SCHEDULE_END_HOUR
+
+
+def _single_instance(func: Callable[[], None]) -> Callable[[], None]:
+    """
+    確保同一排程任務在多個 worker 間同時只有一個在執行
+    
+    以 PostgreSQL session 層級的 advisory lock 決定由哪個 worker 執行，
+    未取得 lock 的 worker 直接略過本次執行。非 PostgreSQL 資料庫不做限制。
+    lock 在任務期間需持有一條連線，因此使用不經過連線池的 _lock_engine。
+    """
+    lock_key = zlib.crc32(func.__qualname__.encode())
+    
+    @functools.wraps(func)
+    def wrapper():
+        if _lock_engine is None:
+            return func()
+        
+        with _lock_engine.connect() as conn:
+            acquired = conn.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {'key': lock_key}
+            ).scalar()
+            conn.commit()  # advisory lock 不隨交易結束釋放，避免連線在任務期間處於 idle in transaction
+            if not acquired:
+                logger.info("%s 已由其他 worker 執行中，略過", func.__name__)
+                return
+            try:
+                return func()
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': lock_key})
+                conn.commit()
+    
+    return wrapper
+
+
+def _only_within_schedule_hours(func: Callable[[], None]) -> Callable[[], None]:
+    """不在排程時間內時直接略過任務 (在取得 advisory lock 之前檢查)"""
+    @functools.wraps(func)
+    def wrapper():
+        if not is_within_schedule_hours():
+            logger.info("目前不在排程時間內，跳過抓取")
+            return
+        return func()
+    
+    return wrapper
+
 
+def _run_concurrently(func: Callable[[Any], Any], items: List[Any]) -> List[Any]:
+    """
+    以有限數量的執行緒並行執行 (用於 LINE 推播等網路 I/O)
+    
+    Returns:
+        各項目的執行結果，順序與 items 相同
+    """
+    if not items:
+        return []
+    
+    max_workers = min(max(settings.LINE_PUSH_CONCURRENCY, 1), len(items))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='line-push') as executor:
+        return list(executor.map(func, items))
 
+
+@_only_within_schedule_hours
+@_single_instance
 def crawl_and_notify():
     """
     主要排程任務：抓取新文章並通知用戶
     
+    只在排程時間內執行 (由 _only_within_schedule_hours 檢查)
+    
     流程：
-    1. 檢查是否在排程時間內
-    2. 抓取 PTT 借貸版新文章
-    3. 過濾符合關鍵字的文章
-    4. 儲存新文章到資料庫
-    5. 為 Premium 用戶即時通知
-    6. 為 Standard 用戶建立待發送通知
+    1. 抓取 PTT 借貸版新文章
+    2. 過濾符合關鍵字的文章
+    3. 儲存新文章並為 Standard 用戶建立待發送通知
+    4. 為 Premium 用戶即時通知並記錄已發送
     """
-    # 檢查排程時間
-    if not is_within_schedule_hours():
-        logger.info("目前不在排程時間內，跳過抓取")
-        return
-    
     logger.info("開始抓取 PTT 借貸版...")
     
-    db = SessionLocal()
-    try:
-        # 抓取新文章
-        articles = crawl_new_articles()
-        logger.info(f"找到 {len(articles)} 篇符合關鍵字的文章")
-        
-        if not articles:
-            return
-        
-        # 取得所有啟用的用戶
-        all_users = crud.get_all_active_users(db)
-        premium_users = [u for u in all_users if u.tier == UserTier.PREMIUM]
-        standard_users = [u for u in all_users if u.tier == UserTier.STANDARD]
-        
-        for article_data in articles:
-            article_id = article_data.get('article_id')
-            if not article_id:
-                continue
-            
-            # 檢查是否已存在
-            existing = crud.get_article_by_ptt_id(db, article_id)
-            if existing:
-                logger.debug(f"文章已存在: {article_id}")
-                continue
-            
-            # 儲存新文章
-            db_article = crud.create_article(
-                db=db,
-                article_id=article_id,
-                title=article_data.get('title', ''),
-                author=article_data.get('author', ''),
-                content=article_data.get('content', ''),
-                url=article_data.get('url', ''),
-                post_time=article_data.get('post_time')
+    with SessionLocal() as db:
+        try:
+            # 抓取新文章
+            articles = crawl_new_articles()
+            logger.info("找到 %d 篇符合關鍵字的文章", len(articles))
+            
+            if not articles:
+                return
+            
+            # 取得所有啟用的 Premium 用戶，只保留推播與記錄需要的欄位
+            premium_users = [
+                (u.id, u.line_user_id)
+                for u in crud.get_all_active_users(db)
+                if u.tier is UserTier.PREMIUM
+            ]
+            
+            # 整理文章欄位 (同一次抓取中重複的文章只保留一筆)
+            rows = {}
+            for article in articles:
+                if not article.article_id or article.article_id in rows:
+                    continue
+                rows[article.article_id] = {
+                    'article_id': article.article_id,
+                    'title': article.title,
+                    'author': article.author,
+                    'content': article.content,
+                    'url': article.url,
+                    'post_time': article.post_time
+                }
+            
+            # 批次儲存新文章，已存在的文章會被資料庫略過
+            new_articles = crud.bulk_create_articles(db, list(rows.values()))
+            
+            # Standard 用戶批次建立待發送通知 (與新文章同一交易，推播中斷也不會遺失)
+            crud.create_pending_notifications_bulk(
+                db, [db_article.id for db_article in new_articles], UserTier.STANDARD
             )
-            logger.info(f"新增文章: {db_article.title[:30]}...")
-            
-            # Premium 用戶即時通知
-            for user in premium_users:
-                success = push_article_notification(
-                    user_id=user.line_user_id,
-                    title=db_article.title,
-                    author=db_article.author,
-                    url=db_article.url,
-                    post_time=db_article.post_time
-                )
-                if success:
-                    # 建立已發送的通知記錄
-                    notification = crud.create_notification(db, user.id, db_article.id)
-                    crud.mark_notification_sent(db, notification.id)
-            
-            # Standard 用戶建立待發送通知
-            for user in standard_users:
-                if not crud.has_notification_for_article(db, user.id, db_article.id):
-                    crud.create_notification(db, user.id, db_article.id)
-        
-        logger.info("抓取任務完成")
-        
-    except Exception as e:
-        logger.error(f"抓取任務發生錯誤: {e}")
-        db.rollback()
-    finally:
-        db.close()
+            db.commit()  # commit 後連線會歸還連線池，推播期間不佔用
+            mark_articles_seen(rows.keys())
+            logger.info("其中 %d 篇為新文章", len(new_articles))
+            
+            if logger.isEnabledFor(logging.DEBUG):
+                for db_article in new_articles:
+                    logger.debug("新增文章: %s...", db_article.title[:30])
+            
+            # 新文章的欄位只讀取一次
+            article_rows = [
+                (a.id, a.title, a.author, a.url, a.post_time) for a in new_articles
+            ]
+            
+            # Premium 用戶即時通知 (並行推播所有用戶 × 新文章)
+            pushes = [
+                (user_id, line_user_id, article)
+                for article in article_rows
+                for user_id, line_user_id in premium_users
+            ]
+            
+            def push(item):
+                _, line_user_id, (_, title, author, url, post_time) = item
+                return push_article_notification(line_user_id, title, author, url, post_time)
+            
+            results = _run_concurrently(push, pushes)
+            
+            # 批次建立已發送的通知記錄
+            crud.create_sent_notifications_bulk(
+                db,
+                [(user_id, article[0]) for (user_id, _, article), success in zip(pushes, results) if success]
+            )
+            db.commit()
+            
+            logger.info("抓取任務完成")
+            
+        except Exception as e:
+            logger.error("抓取任務發生錯誤: %s", e)
+            db.rollback()
 
 
+@_single_instance
 def send_hourly_notifications():
     """
     每小時執行：發送 Standard 用戶的累積通知
     """
     logger.info("開始發送 Standard 用戶的累積通知...")
     
-    db = SessionLocal()
-    try:
-        # 取得所有 Standard 用戶
-        standard_users = crud.get_active_users_by_tier(db, UserTier.STANDARD)
-        
-        for user in standard_users:
-            # 取得待發送通知
-            pending = crud.get_pending_notifications_for_user(db, user.id)
+    with SessionLocal() as db:
+        try:
+            # 一次取得所有 Standard 用戶的待發送通知，再依用戶分組
+            pending = crud.get_pending_notifications_for_standard_users(db)
             
-            if not pending:
-                continue
-            
-            # 準備文章資料
-            articles = []
-            notification_ids = []
+            grouped = {}
             for notification in pending:
+                user = notification.user
+                line_user_id, articles, notification_ids = grouped.setdefault(
+                    user.id, (user.line_user_id, [], [])
+                )
+                
+                # 準備文章資料
                 article = notification.article
                 articles.append({
                     'title': article.title,
@@ -138,35 +214,49 @@ def send_hourly_notifications():
                 })
                 notification_ids.append(notification.id)
             
-            # 發送批次通知
-            success = push_batch_notification(user.line_user_id, articles)
+            batches = [
+                (user_id, line_user_id, articles, notification_ids)
+                for user_id, (line_user_id, articles, notification_ids) in grouped.items()
+            ]
             
-            if success:
-                # 標記為已發送
-                crud.mark_notifications_sent(db, notification_ids)
-                logger.info(f"已發送 {len(articles)} 篇文章通知給用戶 {user.id}")
-        
-        logger.info("累積通知發送完成")
-        
-    except Exception as e:
-        logger.error(f"發送累積通知發生錯誤: {e}")
-        db.rollback()
-    finally:
-        db.close()
+            # 結束讀取交易，推播期間不佔用資料庫連線
+            db.commit()
+            
+            # 並行發送批次通知
+            results = _run_concurrently(
+                lambda batch: push_batch_notification(batch[1], batch[2]),
+                batches
+            )
+            
+            sent_ids = []
+            for (user_id, _, articles, notification_ids), success in zip(batches, results):
+                if success:
+                    sent_ids.extend(notification_ids)
+                    logger.debug("已發送 %d 篇文章通知給用戶 %s", len(articles), user_id)
+            
+            # 一次標記所有已發送的通知
+            crud.mark_notifications_sent(db, sent_ids)
+            db.commit()
+            
+            logger.info("累積通知發送完成，成功發送給 %d / %d 位用戶", sum(results), len(batches))
+            
+        except Exception as e:
+            logger.error("發送累積通知發生錯誤: %s", e)
+            db.rollback()
 
 
+@_single_instance
 def cleanup_old_articles():
     """
     每日執行：清理超過保留期限的舊文章
     """
-    logger.info(f"開始清理超過 {settings.RETENTION_DAYS} 天的舊文章...")
+    logger.info("開始清理超過 %d 天的舊文章...", settings.RETENTION_DAYS)
     
-    db = SessionLocal()
-    try:
-        count = crud.delete_old_articles(db)
-        logger.info(f"已刪除 {count} 篇舊文章")
-    except Exception as e:
-        logger.error(f"清理舊文章發生錯誤: {e}")
-        db.rollback()
-    finally:
-        db.close()
+    with SessionLocal() as db:
+        try:
+            count = crud.delete_old_articles(db)
+            db.commit()
+            logger.info("已刪除 %d 篇舊文章", count)
+        except Exception as e:
+            logger.error("清理舊文章發生錯誤: %s", e)
+            db.rollback()
@@ -6,6 +6,7 @@ import json
 sys.path.insert(0, r'd:\Vibe project\PTT')
 
 from crawler.ptt_scraper import PTTScraper
+from crawler.parser import filter_by_keywords
 
 def main():
     print("=" * 60)
@@ -23,17 +24,15 @@ def main():
     
     # 顯示所有文章標題
     for i, article in enumerate(articles, 1):
-        print(f"{i:2}. [{article['date']}] {article['title']}")
-        print(f"    👤 作者: {article['author']}")
-        print(f"    🔗 {article['url']}")
+        print(f"{i:2}. [{article.date}] {article.title}")
+        print(f"    👤 作者: {article.author}")
+        print(f"    🔗 {article.url}")
         print()
     
     # 過濾包含「信貸」或「個人信貸」的文章
+    # 與正式爬蟲使用同一個預先編譯的關鍵字比對
     keywords = ["信貸", "個人信貸"]
-    filtered = []
-    for article in articles:
-        if any(kw in article['title'] for kw in keywords):
-            filtered.append(article)
+    filtered = filter_by_keywords(articles, keywords)
     
     print("=" * 60)
     print(f"🏷️ 符合關鍵字【信貸/個人信貸】的文章: {len(filtered)} 篇")
@@ -41,14 +40,14 @@ def main():
     
     if filtered:
         for article in filtered:
-            print(f"\n📌 {article['title']}")
-            print(f"   👤 作者: {article['author']}")
-            print(f"   📅 日期: {article['date']}")
-            print(f"   🔗 {article['url']}")
+            print(f"\n📌 {article.title}")
+            print(f"   👤 作者: {article.author}")
+            print(f"   📅 日期: {article.date}")
+            print(f"   🔗 {article.url}")
             
             # 取得文章內容
             print(f"\n   📄 正在抓取文章內容...")
-            content_data = scraper.get_article_content(article['url'])
+            content_data = scraper.get_article_content(article.url)
             if content_data.get('content'):
                 content = content_data['content']
                 # 只顯示前 500 字